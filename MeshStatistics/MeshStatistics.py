@@ -1,15 +1,14 @@
 from __future__ import print_function
 
 import numpy
-import math
 import re
-import csv
 import os
 import sys
 import logging
 from __main__ import vtk, qt, ctk, slicer
 from random import randint
 from slicer.ScriptedLoadableModule import *
+from MeshStatisticsLib import MeshStatisticsCore
 
 class MeshStatistics(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -23,7 +22,8 @@ class MeshStatistics(ScriptedLoadableModule):
             considering a specific region (defined with Pick'n Paint) or on the entire shape.
             Statistics are: Minimum Value, Maximum Value, Average, Standard Deviation, and different type of percentile.
             It's possible to export those values as CSV file.
-            Before working on Mesh Statistics, you have to compute ModelToModelDistance.
+            Before working on Mesh Statistics, you have to compute ModelToModelDistance,
+            or compute the point to point distances to a target model directly in this module.
             """
         parent.acknowledgementText = """
             This file was originally developed by Lucie Macron, University of Michigan.
@@ -83,15 +83,77 @@ class MeshStatisticsWidget(ScriptedLoadableModuleWidget):
         self.tableField.setColumnWidth(1, 260)
         self.tableField.setSizePolicy(qt.QSizePolicy().Expanding, qt.QSizePolicy().Expanding)
         # ------------------------------------------------------------------------------------
+        #                                DISTANCE COMPUTATION
+        # ------------------------------------------------------------------------------------
+        self.targetModelComboBox = slicer.qMRMLNodeComboBox()
+        self.targetModelComboBox.nodeTypes = ['vtkMRMLModelNode']
+        self.targetModelComboBox.selectNodeUponCreation = False
+        self.targetModelComboBox.noneEnabled = True
+        self.targetModelComboBox.addEnabled = False
+        self.targetModelComboBox.removeEnabled = False
+        self.targetModelComboBox.setMRMLScene(slicer.mrmlScene)
+        self.distanceModeComboBox = qt.QComboBox()
+        self.distanceModeComboBox.addItems(['Closest Point', 'Corresponding Point'])
+        self.computeDistanceButton = qt.QPushButton(' Compute Distances ')
+        self.computeDistanceButton.connect('clicked()', self.onComputeDistanceButton)
+
+        self.distanceLayout = qt.QHBoxLayout()
+        self.distanceLayout.addWidget(qt.QLabel('Distance to: '))
+        self.distanceLayout.addWidget(self.targetModelComboBox)
+        self.distanceLayout.addWidget(self.distanceModeComboBox)
+        self.distanceLayout.addWidget(self.computeDistanceButton)
+        # ------------------------------------------------------------------------------------
+        #                              LOCAL NEIGHBOURHOOD MAPS
+        # ------------------------------------------------------------------------------------
+        self.neighbourhoodRingsSpinBox = qt.QSpinBox()
+        self.neighbourhoodRingsSpinBox.setRange(1, 6)
+        self.neighbourhoodRingsSpinBox.setValue(2)
+        self.neighbourhoodRingsSpinBox.setSuffix(' ring(s)')
+        self.neighbourhoodRadiusSpinBox = qt.QDoubleSpinBox()
+        self.neighbourhoodRadiusSpinBox.setRange(0.0, 100.0)
+        self.neighbourhoodRadiusSpinBox.setSuffix(' mm')
+        self.neighbourhoodRadiusSpinBox.setToolTip('Radius of the neighbourhood of each point, '
+                                                   'the number of rings is used if the radius is 0')
+        self.computeNeighbourhoodButton = qt.QPushButton(' Compute Local Maps ')
+        self.computeNeighbourhoodButton.setToolTip('Add the local mean, SD and percentile rank '
+                                                   'of the checked fields to the models')
+        self.computeNeighbourhoodButton.connect('clicked()', self.onComputeNeighbourhoodButton)
+
+        self.neighbourhoodLayout = qt.QHBoxLayout()
+        self.neighbourhoodLayout.addWidget(qt.QLabel('Neighbourhood: '))
+        self.neighbourhoodLayout.addWidget(self.neighbourhoodRingsSpinBox)
+        self.neighbourhoodLayout.addWidget(self.neighbourhoodRadiusSpinBox)
+        self.neighbourhoodLayout.addWidget(self.computeNeighbourhoodButton)
+        # ------------------------------------------------------------------------------------
         #                                    RUN
         # ------------------------------------------------------------------------------------
         self.runButton = self.logic.get("runButton")
         self.runButton.connect('clicked()', self.onRunButton)
+        self.previewCheckBox = qt.QCheckBox('Preview Estimates First')
+        self.previewCheckBox.setToolTip('Display statistics estimated on a subsample of each region, '
+                                        'then replace them by the exact values as they are computed')
+        # ------------------------------------------------------------------------------------
+        #                                    LONGITUDINAL
+        # ------------------------------------------------------------------------------------
+        self.longitudinalCheckBox = qt.QCheckBox('Longitudinal')
+        self.longitudinalCheckBox.setToolTip('Consider the models, in the order of their times, as the timepoints of '
+                                             'corresponding meshes and compute the change of the checked fields '
+                                             '(or of the position of the points if no field is checked)')
+        self.longitudinalCheckBox.connect('stateChanged(int)', self.onLongitudinalCheckBoxStateChanged)
+        self.timesLineEdit = qt.QLineEdit()
+        self.timesLineEdit.setPlaceholderText('Times of the models: 0, 1, 2, ...')
+        self.longitudinalLayout = qt.QHBoxLayout()
+        self.longitudinalLayout.addWidget(self.longitudinalCheckBox)
+        self.longitudinalLayout.addWidget(self.timesLineEdit)
 
         # ------------------------------------------------------------------------------------
         #                          Statistics Table - Export
         # ------------------------------------------------------------------------------------
         self.mainLayout = self.logic.get("mainLayout")
+        self.mainLayout.insertLayout(self.mainLayout.indexOf(self.runButton), self.distanceLayout)
+        self.mainLayout.insertLayout(self.mainLayout.indexOf(self.runButton), self.neighbourhoodLayout)
+        self.mainLayout.insertWidget(self.mainLayout.indexOf(self.runButton), self.previewCheckBox)
+        self.mainLayout.insertLayout(self.mainLayout.indexOf(self.runButton), self.longitudinalLayout)
         self.tabROI = qt.QTabWidget()
         self.tabROI.setTabPosition(0)
         self.tabROI.adjustSize()
@@ -102,17 +164,25 @@ class MeshStatisticsWidget(ScriptedLoadableModuleWidget):
         self.exportButton = qt.QPushButton(' Export ')
         self.exportButton.enabled = True
         self.exportPointValueCheckBox = qt.QCheckBox('Export Value on Each Point')
-        
+        self.exportPointValueMatrixCheckBox = qt.QCheckBox('One Matrix per Field')
+        self.exportPointValueMatrixCheckBox.setToolTip('Export the values on each point of all the models '
+                                                       'in one file per region and field')
+        self.exportWhileComputingCheckBox = qt.QCheckBox('Export While Computing')
+        self.exportWhileComputingCheckBox.setToolTip('Write the files in this folder as soon as the statistics '
+                                                     'are computed by Run')
+
         self.exportLayout = qt.QVBoxLayout()
         self.directoryAndExportLayout = qt.QHBoxLayout()
         self.directoryAndExportLayout.addWidget(self.directoryExport)
         self.directoryAndExportLayout.addWidget(self.exportCheckBox)
         self.directoryAndExportLayout.addWidget(self.exportPointValueCheckBox)
+        self.directoryAndExportLayout.addWidget(self.exportPointValueMatrixCheckBox)
+        self.directoryAndExportLayout.addWidget(self.exportWhileComputingCheckBox)
         self.exportButtonsLayout = qt.QHBoxLayout()
         self.exportButtonsLayout.addWidget(self.exportButton)
         
-
-        self.exportLayout.addLayout(self.directoryAndExportLayout)
+        #  The folder and the options are chosen before Run, so that the files can be written while computing
+        self.mainLayout.insertLayout(self.mainLayout.indexOf(self.runButton), self.directoryAndExportLayout)
         self.exportLayout.addLayout(self.exportButtonsLayout)
         
         self.layout.addStretch(1)
@@ -130,6 +200,7 @@ class MeshStatisticsWidget(ScriptedLoadableModuleWidget):
         self.fieldList = list()
         self.ROIList = list()
         self.ROIDict = dict()
+        self.logic.locatorCache.clear()
         self.ROIComboBox.clear()
         self.tableField.clearContents()
         self.tableField.setRowCount(0)
@@ -153,45 +224,89 @@ class MeshStatisticsWidget(ScriptedLoadableModuleWidget):
             if intCheckState == 0:
                 self.ROIComboBox.setEnabled(True)
 
+    def onLongitudinalCheckBoxStateChanged(self, intCheckState):
+        #  The longitudinal statistics are neither estimated first nor exported while computing
+        self.previewCheckBox.setEnabled(intCheckState == 0)
+        self.exportWhileComputingCheckBox.setEnabled(intCheckState == 0)
+
+    def onComputeDistanceButton(self):
+        targetModel = self.targetModelComboBox.currentNode()
+        if not targetModel or not self.modelList:
+            slicer.util.errorDisplay("Please select at least a model and a target model")
+            return
+        correspondingPoints = self.distanceModeComboBox.currentText == 'Corresponding Point'
+        self.logic.computeDistancesOnModels(self.modelList, targetModel, correspondingPoints)
+        self.logic.updateInterface(self.tableField, self.ROIComboBox, self.ROIList, self.modelList, self.mainLayout)
+
+    def onComputeNeighbourhoodButton(self):
+        fieldNames = self.logic.getCheckedFields(self.tableField)
+        if not self.modelList or not fieldNames:
+            slicer.util.errorDisplay("Please select at least a model and a field")
+            return
+        self.logic.computeNeighbourhoodMapsOnModels(self.modelList, fieldNames,
+                                                    self.neighbourhoodRingsSpinBox.value,
+                                                    self.neighbourhoodRadiusSpinBox.value)
+        self.logic.updateInterface(self.tableField, self.ROIComboBox, self.ROIList, self.modelList, self.mainLayout)
+
     def onRunButton(self):
-        self.ROIDict.clear()
-        if self.modelList:
-            self.logic.removeTable(self.mainLayout, self.tabROI)
-            self.exportButton.disconnect('clicked()', self.onExportButton)
-            self.mainLayout.removeWidget(self.exportButton)
-            self.mainLayout.removeItem(self.exportLayout)
-        self.logic.displayStatistics(self.ROICheckBox.isChecked(), self.ROIList, self.ROIDict, self.ROIComboBox,
-                                     self.tableField, self.modelList, self.tabROI, self.mainLayout)
-        self.mainLayout.addLayout(self.exportLayout)
-        self.exportButton.connect('clicked()', self.onExportButton)
+        #  The preview updates the interface while computing: the widgets changing the models or ROIDict
+        #  are disabled until the end of the run, so that a second run or an export cannot start meanwhile
+        widgetList = [self.inputComboBox, self.runButton, self.exportButton, self.computeDistanceButton,
+                      self.computeNeighbourhoodButton]
+        for widget in widgetList:
+            widget.enabled = False
+        try:
+            self.ROIDict.clear()
+            if self.modelList:
+                self.logic.removeTable(self.mainLayout, self.tabROI)
+                self.exportButton.disconnect('clicked()', self.onExportButton)
+                self.mainLayout.removeWidget(self.exportButton)
+                self.mainLayout.removeItem(self.exportLayout)
+            if self.longitudinalCheckBox.isChecked():
+                self.logic.displayLongitudinalStatistics(self.ROICheckBox.isChecked(), self.ROIList, self.ROIDict,
+                                                         self.ROIComboBox, self.tableField, self.modelList, self.tabROI,
+                                                         self.mainLayout, self.timesLineEdit.text)
+                #  The change arrays added to the earliest model are listed with the other fields
+                self.logic.updateInterface(self.tableField, self.ROIComboBox, self.ROIList, self.modelList,
+                                           self.mainLayout)
+            else:
+                exportPipeline = None
+                if self.exportWhileComputingCheckBox.isChecked():
+                    exportPipeline = MeshStatisticsLogic.ExportPipeline(self.directoryExport.directory,
+                                                                        self.exportCheckBox.isChecked(),
+                                                                        self.exportPointValueCheckBox.isChecked(),
+                                                                        self.exportPointValueMatrixCheckBox.isChecked())
+                previewSampleSize = self.logic.previewSampleSize if self.previewCheckBox.isChecked() else 0
+                self.logic.displayStatistics(self.ROICheckBox.isChecked(), self.ROIList, self.ROIDict,
+                                             self.ROIComboBox, self.tableField, self.modelList, self.tabROI,
+                                             self.mainLayout, exportPipeline, previewSampleSize)
+            self.mainLayout.addLayout(self.exportLayout)
+            self.exportButton.connect('clicked()', self.onExportButton)
+        finally:
+            for widget in widgetList:
+                widget.enabled = True
+            self.runButton.enabled = not self.inputComboBox.noneChecked()
 
 
     def onExportButton(self):
         self.logic.exportationFunction(self.directoryExport, self.exportCheckBox.isChecked(), self.ROIDict)
         if self.exportPointValueCheckBox.isChecked():
-            self.logic.ExportationValueOnEachPoint(self.directoryExport, self.ROIDict)
-
-
-class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
-    class StatisticStore(object):
-        def __init__(self):
-            self.min = 0
-            self.max = 0
-            self.mean = 0
-            self.std = 0
-            self.percentile5 = 0
-            self.percentile15 = 0
-            self.percentile25 = 0
-            self.percentile50 = 0
-            self.percentile75 = 0
-            self.percentile85 = 0
-            self.percentile95 = 0
+            if self.exportPointValueMatrixCheckBox.isChecked():
+                self.logic.ExportationValueMatrixOnEachPoint(self.directoryExport, self.ROIDict)
+            else:
+                self.logic.ExportationValueOnEachPoint(self.directoryExport, self.ROIDict)
+
+
+class MeshStatisticsLogic(ScriptedLoadableModuleLogic, MeshStatisticsCore):
+    #  Connection of MeshStatisticsCore (statistics, distances, exportation) to the Slicer interface
 
     def __init__(self, interface=None):
         self.interface = interface
-        self.numberOfDecimals = 3
         system = qt.QLocale().system()
-        self.decimalPoint = chr(system.decimalPoint())
+        MeshStatisticsCore.__init__(self, decimalPoint=chr(system.decimalPoint()), numberOfThreads=os.cpu_count() or 1)
+
+    def errorDisplay(self, message):
+        slicer.util.errorDisplay(message)
 
     # -------------------------------------------------------- #
     # ----------- Connection of the User Interface ----------- #
@@ -275,11 +390,6 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
 
         layout.addStretch(1)
 
-    def compareList(self, list1, list2):
-        ListInCommon = list(set(list1) & set(list2))
-        ListNotInCommon = (list(set(list1) - set(list2)) + list(set(list2) - set(list1)))
-        return ListInCommon, ListNotInCommon
-
     def defineStatisticsTable(self, fieldDictionaryValue):
         statTable = qt.QTableWidget()
         numberOfRows = fieldDictionaryValue.__len__()
@@ -292,33 +402,32 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
         statTable.setHorizontalHeaderLabels(['Model','Min','Max','Mean','SD','Per5','Per15','Per25','Per50','Per75','Per85','Per95'])
         # Add Values:
         for key, value in fieldDictionaryValue.items():
-            statTable.setCellWidget(i, 0, qt.QLabel(key))
-            statTable.setCellWidget(i, 1, qt.QLabel(value.min))
-            statTable.cellWidget(i,1).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 2, qt.QLabel(value.max))
-            statTable.cellWidget(i,2).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 3, qt.QLabel(value.mean))
-            statTable.cellWidget(i,3).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 4, qt.QLabel(value.std))
-            statTable.cellWidget(i,4).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 5, qt.QLabel(value.percentile5))
-            statTable.cellWidget(i,5).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 6, qt.QLabel(value.percentile15))
-            statTable.cellWidget(i,6).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 7, qt.QLabel(value.percentile25))
-            statTable.cellWidget(i,7).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 8, qt.QLabel(value.percentile50))
-            statTable.cellWidget(i,8).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 9, qt.QLabel(value.percentile75))
-            statTable.cellWidget(i,9).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 10, qt.QLabel(value.percentile85))
-            statTable.cellWidget(i,10).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
-            statTable.setCellWidget(i, 11, qt.QLabel(value.percentile95))
-            statTable.cellWidget(i,11).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
+            self.updateTableRow(statTable, i, key, value)
             i -= 1
         statTable.resizeColumnToContents(0)
         return statTable
 
+    def updateTableRow(self, statTable, row, modelName, value):
+        #  Estimated statistics are displayed with a tilde and their 95% confidence interval
+        statTable.setCellWidget(row, 0, qt.QLabel(modelName))
+        statisticNames = ['min', 'max', 'mean', 'std', 'percentile5', 'percentile15', 'percentile25',
+                          'percentile50', 'percentile75', 'percentile85', 'percentile95']
+        for column, statisticName in enumerate(statisticNames, 1):
+            statistic = getattr(value, statisticName)
+            if value.isEstimate:
+                statistic = '~' + str(statistic)
+                if statisticName in value.errors:
+                    statistic += ' \u00b1 ' + str(value.errors[statisticName])
+            statTable.setCellWidget(row, column, qt.QLabel(statistic))
+            statTable.cellWidget(row, column).setStyleSheet(' QLabel{ qproperty-alignment: AlignCenter;}')
+
+    def refreshTableRow(self, ROIDict, tabROI, ROIName, fieldName, modelName):
+        #  Display the statistics of one model again, in the table built by updateTable
+        fieldDict = ROIDict[ROIName]
+        modelDict = fieldDict[fieldName]
+        statTable = tabROI.widget(list(ROIDict.keys()).index(ROIName)).widget(list(fieldDict.keys()).index(fieldName))
+        row = len(modelDict) - 1 - list(modelDict.keys()).index(modelName)
+        self.updateTableRow(statTable, row, modelName, modelDict[modelName])
 
     def updateTable(self, ROIDict, tabROI, layout):
         tabROI.setMinimumWidth(100*ROIDict.__len__())
@@ -332,7 +441,10 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
             tabROI.addTab(tab, ROIName)
         layout.addWidget(tabROI)
 
-    def displayStatistics(self, ROICheckBoxState, ROIList, ROIDict, ROIComboBox, tableField, modelList, tabROI, layout):
+    def displayStatistics(self, ROICheckBoxState, ROIList, ROIDict, ROIComboBox, tableField, modelList, tabROI, layout,
+                          exportPipeline=None, previewSampleSize=0):
+        #  If previewSampleSize is not 0, statistics are first estimated on a subsample of each ROI and displayed,
+        #  then they are replaced by the exact ones as they are computed
         if ROICheckBoxState:
             for ROIName in ROIList:
                 if not ROIName in ROIDict:
@@ -348,18 +460,140 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
                 widget = tableField.cellWidget(i, 0)
                 if widget and widget.isChecked():
                     ROIFieldDict[tableField.cellWidget(i, 1).text] = dict()
+        if exportPipeline:
+            #  The writers are always stopped, so that the files already queued are written even if computing fails
+            try:
+                self.prepareExportPipeline(exportPipeline, ROIDict, [shape.GetName() for shape in modelList])
+                self.computeStatistics(ROIDict, modelList, tabROI, layout, exportPipeline, previewSampleSize)
+            finally:
+                errors = exportPipeline.close()
+            if errors:
+                slicer.util.errorDisplay("Some files could not be exported:\n" + '\n'.join(errors))
+        else:
+            self.computeStatistics(ROIDict, modelList, tabROI, layout, exportPipeline, previewSampleSize)
+        if not previewSampleSize:
+            self.updateTable(ROIDict, tabROI, layout)
+
+    def computeStatistics(self, ROIDict, modelList, tabROI, layout, exportPipeline, previewSampleSize):
+        if previewSampleSize:
+            for ROIName, ROIFieldDict in ROIDict.items():
+                for fieldName, fieldValue in ROIFieldDict.items():
+                    for shape in modelList:
+                        activePointData = shape.GetModelDisplayNode().GetInputPolyData().GetPointData()
+                        fieldValue[shape.GetName()] = self.StatisticStore()
+                        ROIArray = None if ROIName == 'Entire Model' else activePointData.GetArray(ROIName)
+                        self.computeEstimate(activePointData.GetArray(fieldName), fieldValue[shape.GetName()],
+                                             ROIArray, previewSampleSize)
+            self.updateTable(ROIDict, tabROI, layout)
+            slicer.app.processEvents()
+
+        for ROIName, ROIFieldDict in ROIDict.items():
             for fieldName, fieldValue in ROIFieldDict.items():
                 for shape in modelList:
                     activePointData = shape.GetModelDisplayNode().GetInputPolyData().GetPointData()
                     fieldArray = activePointData.GetArray(fieldName)
                     fieldValue[shape.GetName()] = self.StatisticStore()
                     if ROIName == 'Entire Model':
-                        self.computeAll(fieldArray, fieldValue[shape.GetName()], None)
+                        ROIArray = None
                     else:
                         ROIArray = activePointData.GetArray(ROIName)
-                        self.computeAll(fieldArray, fieldValue[shape.GetName()], ROIArray)
+                    self.computeAll(fieldArray, fieldValue[shape.GetName()], ROIArray)
+                    if previewSampleSize:
+                        self.refreshTableRow(ROIDict, tabROI, ROIName, fieldName, shape.GetName())
+                        slicer.app.processEvents()
+                    if exportPipeline:
+                        self.submitPointValues(exportPipeline, ROIName, fieldName, shape.GetName(), fieldArray, ROIArray)
+                if exportPipeline:
+                    self.submitField(exportPipeline, ROIName, fieldName, fieldValue, modelList)
+            if exportPipeline and not exportPipeline.separateFiles:
+                exportPipeline.submit(exportPipeline.statisticsFilename(ROIName, None), self.exportAllAsCSV,
+                                      ROIName, ROIFieldDict)
+
+    def getCheckedFields(self, tableField):
+        fieldNames = list()
+        for i in range(0, tableField.rowCount):
+            widget = tableField.cellWidget(i, 0)
+            if widget and widget.isChecked():
+                fieldNames.append(tableField.cellWidget(i, 1).text)
+        return fieldNames
+
+    def displayLongitudinalStatistics(self, ROICheckBoxState, ROIList, ROIDict, ROIComboBox, tableField, modelList,
+                                      tabROI, layout, timesText):
+        #  The models of modelList are the timepoints of corresponding meshes, in any order: they are sorted by
+        #  their times. The change of each checked field (or the displacement of the points if no field is
+        #  checked) is added to the earliest model, and its statistics on each ROI of this model are stored
+        #  in ROIDict under its name
+        if len(modelList) < 2:
+            slicer.util.errorDisplay("Please select at least two models")
+            return
+        try:
+            times = [float(time) for time in timesText.split(',')] if timesText.strip() else range(0, len(modelList))
+        except ValueError:
+            slicer.util.errorDisplay("The times of the models have to be numbers separated by commas")
+            return
+        times = list(times)
+        if len(times) != len(modelList) or len(set(times)) != len(times):
+            slicer.util.errorDisplay("Please give one time per model, two models cannot have the same time")
+            return
+        order = numpy.argsort(times, kind='stable')
+        times = [times[i] for i in order]
+        modelList = [modelList[i] for i in order]
+
+        polyDataList = [shape.GetModelDisplayNode().GetInputPolyData() for shape in modelList]
+        valueMatrixDict = dict()
+        for fieldName in self.getCheckedFields(tableField):
+            valueMatrixDict[fieldName] = self.stackTimepoints([polyData.GetPointData().GetArray(fieldName)
+                                                               for polyData in polyDataList])
+        if not valueMatrixDict:
+            valueMatrixDict['Displacement'] = self.defineDisplacementMatrix(polyDataList)
+
+        ROINames = ROIList if ROICheckBoxState else [ROIComboBox.currentText]
+        baselinePointData = polyDataList[0].GetPointData()
+        for fieldName, (bool, valueMatrix) in valueMatrixDict.items():
+            if not bool:
+                slicer.util.errorDisplay("The models do not have the same number of points")
+                return
+            longitudinalFields = self.defineLongitudinalFields(fieldName, valueMatrix, times)
+            self.addPointDataArrays(polyDataList[0], dict(longitudinalFields))
+            for ROIName in ROINames:
+                ROIArray = None if ROIName == 'Entire Model' else baselinePointData.GetArray(ROIName)
+                ROIFieldDict = ROIDict.setdefault(ROIName, dict())
+                for longitudinalFieldName, values in longitudinalFields:
+                    ROIFieldDict[longitudinalFieldName] = {modelList[0].GetName(): self.StatisticStore()}
+                    self.computeAll(values, ROIFieldDict[longitudinalFieldName][modelList[0].GetName()], ROIArray)
         self.updateTable(ROIDict, tabROI, layout)
 
+    def prepareExportPipeline(self, exportPipeline, ROIDict, modelNames):
+        #  Overwriting the existing files is decided once, before computing
+        existingFilenames = [filename for filename in exportPipeline.filenames(ROIDict, modelNames)
+                             if os.path.exists(filename)]
+        if existingFilenames and not self.confirmOverwrite(existingFilenames):
+            exportPipeline.skippedFilenames = set(existingFilenames)
+        exportPipeline.start()
+
+    def submitPointValues(self, exportPipeline, ROIName, fieldName, modelName, fieldArray, ROIArray):
+        #  Values on each point in one file per model, the ROI values are extracted before being queued
+        if not exportPipeline.exportPointValue or exportPipeline.pointValueMatrix or ROIName == 'Entire Model':
+            return
+        bool, valueArray = self.defineArray(fieldArray, ROIArray)
+        if bool and len(valueArray) != 0:
+            exportPipeline.submit(exportPipeline.pointValueFilename(ROIName, fieldName, modelName),
+                                  self.writePointValueFile, valueArray)
+
+    def submitField(self, exportPipeline, ROIName, fieldName, modelDict, modelList):
+        #  Called once the statistics of all the models are computed for a field
+        if exportPipeline.separateFiles:
+            exportPipeline.submit(exportPipeline.statisticsFilename(ROIName, fieldName), self.exportFieldAsCSV,
+                                  fieldName, modelDict)
+        if exportPipeline.exportPointValue and exportPipeline.pointValueMatrix:
+            modelNames = sorted(modelDict.keys())
+            pointDataDict = dict([(shape.GetName(), shape.GetModelDisplayNode().GetInputPolyData().GetPointData())
+                                  for shape in modelList])
+            pointIndices, valueMatrix = self.definePointValueMatrix(ROIName, fieldName,
+                                                                    [pointDataDict[modelName] for modelName in modelNames])
+            exportPipeline.submit(exportPipeline.pointValueFilename(ROIName, fieldName, None),
+                                  self.exportPointValueMatrixAsCSV, modelNames, pointIndices, valueMatrix)
+
     def removeTable(self, layout, tabROI):
         # Remove table if it already exists:
         indexWidgetTabROI = layout.indexOf(tabROI)
@@ -373,139 +607,47 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
                 tabWidget.clear()
             tabROI.clear()
 
-    def defineArray(self, fieldArray, ROIArray):
-        #  Define array of value from fieldArray(array with all the distances from ModelToModelDistance)
-        #  using ROIArray as a mask
-        #  Return a numpy.array to be able to use numpy's method to compute statistics
-        valueList = list()
-        bool = True
-        if ROIArray == None:
-            for i in range(0, fieldArray.GetNumberOfTuples()):
-                valueList.append(fieldArray.GetValue(i))
-            valueArray = numpy.array(valueList)
-        else:
-            if ROIArray.GetNumberOfTuples() != fieldArray.GetNumberOfTuples():
-                print('Size of ROIArray and fieldArray are not the same!!!')
-                bool = False
-            else:
-                for i in range(0, fieldArray.GetNumberOfTuples()):
-                    if ROIArray.GetValue(i) == 1.0:
-                        valueList.append(fieldArray.GetValue(i))
-                valueArray = numpy.array(valueList)
-        return bool, valueArray
-
-    def computeMean(self, valueArray):
-        #  valueArray is an array in which values to compute statistics on are stored
-        return round(numpy.mean(valueArray), self.numberOfDecimals)
-
-    def computeMinMax(self, valueArray):
-        #  valueArray is an array in which values to compute statistics on are stored
-        return round(numpy.min(valueArray), self.numberOfDecimals), round(numpy.max(valueArray), self.numberOfDecimals)
-
-    def computeStandardDeviation(self, valueArray):
-        #  valueArray is an array in which values to compute statistics on are stored
-        return round(numpy.std(valueArray), self.numberOfDecimals)
-
-    def computeQuantiles(self, valueArray):
-        quantiles = [0.05, 0.15, 0.25, 0.50, 0.75, 0.85, 0.95]
-        quantile_values = numpy.quantile(valueArray, quantiles)
-        quantile_values = numpy.around(quantile_values, self.numberOfDecimals)
-        return quantile_values
-
-
-    def computeAll(self, fieldArray, fieldState, ROIArray):
-        bool, array = self.defineArray(fieldArray, ROIArray)
-        if len(array) == 0:
-            slicer.util.errorDisplay("The ROI is empty")
-            return
-        if bool:
-            fieldState.min, fieldState.max = self.computeMinMax(array)
-            fieldState.mean = self.computeMean(array)
-            fieldState.std = self.computeStandardDeviation(array)
-
-            quantile_values = self.computeQuantiles(array)
-
-            fieldState.percentile5 = quantile_values[0]
-            fieldState.percentile15 = quantile_values[1]
-            fieldState.percentile25 = quantile_values[2]
-            fieldState.percentile50 = quantile_values[3]
-            fieldState.percentile75 = quantile_values[4]
-            fieldState.percentile85 = quantile_values[5]
-            fieldState.percentile95 = quantile_values[6]
-
-    def writeFieldFile(self, fileWriter, modelDict):
-        #  Function defined to export all statistics of a field concidering a file writer (fileWriter)
-        #  and a dictionary of models (modelDict) where statistics are stored
-        for shapeName, shapeStats in modelDict.items():
-            fileWriter.writerow([shapeName,
-                                 shapeStats.min,
-                                 shapeStats.max,
-                                 shapeStats.mean,
-                                 shapeStats.std,
-                                 shapeStats.percentile5,
-                                 shapeStats.percentile15,
-                                 shapeStats.percentile25,
-                                 shapeStats.percentile50,
-                                 shapeStats.percentile75,
-                                 shapeStats.percentile85,
-                                 shapeStats.percentile95])
-
-    def exportAllAsCSV(self, filename, ROIName, ROIDictValue):
-        #  Export all fields on the same csv file considering a region
-        file = open(filename, 'w')
-        cw = csv.writer(file, delimiter=',')
-        cw.writerow([ROIName])
-        cw.writerow([' '])
-        for fieldName, shapeDict in sorted(ROIDictValue.items()):
-            cw.writerow([fieldName])
-            cw.writerow(['Model','Min','Max','Mean','SD','Per5','Per15','Per25','Per50','Per75','Per85','Per95'])
-            self.writeFieldFile(cw, shapeDict)
-            cw.writerow([' '])
-        file.close()
-        if self.decimalPoint != '.':
-            self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
-            self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
-
-    def exportFieldAsCSV(self, filename, fieldName, shapeDict):
-        #  Export fields on different csv files
-        file = open(filename, 'w')
-        cw = csv.writer(file, delimiter=',')
-        cw.writerow([fieldName])
-        cw.writerow(['Model','Min','Max','Mean','SD','Per5','Per15','Per25','Per50','Per75','Per85','Per95'])
-        self.writeFieldFile(cw, shapeDict)
-        file.close()
-        if self.decimalPoint != '.':
-            self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
-            self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
-
-    
-    def exportPointValueAsCSV(self, filename, fieldArray, ROIArray):
-        #Exportation of the value stored for each point:
-        file = open(filename, 'w')
-        cw = csv.writer(file, delimiter=',')
-        bool, arrayToReturn = self.defineArray(fieldArray, ROIArray)
-        if len(arrayToReturn) == 0:
-            slicer.util.errorDisplay("The ROI is empty")
-            return
-        if bool:
-            for value in arrayToReturn:
-                cw.writerow([value])
-            file.close()
-            if self.decimalPoint != '.':
-                self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
-                self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
-
-
-    def replaceCharac(self, filename, oldCharac, newCharac):
-        #  Function to replace a charactere (oldCharac) in a file (filename) by a new one (newCharac)
-        file = open(filename,'r')
-        lines = file.readlines()
-        with open(filename, 'r') as file:
-            lines = [line.replace(oldCharac, newCharac) for line in file.readlines()]
-        file.close()
-        file = open(filename, 'w')
-        file.writelines(lines)
-        file.close()
+    def computeDistancesOnModels(self, modelList, targetModel, correspondingPoints):
+        targetPolyData = targetModel.GetPolyData()
+        for model in modelList:
+            if model.GetID() == targetModel.GetID():
+                continue
+            polyData = model.GetPolyData()
+            distanceDict = self.computeDistances(polyData, targetPolyData, correspondingPoints, targetModel.GetID())
+            if distanceDict is None:
+                slicer.util.errorDisplay("The models " + model.GetName() + " and " + targetModel.GetName() +
+                                         " do not have the same number of points")
+                continue
+            self.addPointDataArrays(polyData, distanceDict)
+
+    def computeNeighbourhoodMapsOnModels(self, modelList, fieldNames, numberOfRings, radius):
+        #  The neighbourhoods are built once per model and used for all the fields
+        for model in modelList:
+            polyData = model.GetPolyData()
+            modelFieldNames = [fieldName for fieldName in fieldNames if polyData.GetPointData().GetArray(fieldName)]
+            resultList = self.computeNeighbourhoodStatistics(polyData,
+                                                             [polyData.GetPointData().GetArray(fieldName)
+                                                              for fieldName in modelFieldNames],
+                                                             numberOfRings, radius)
+            if resultList is None:
+                return
+            valueDict = dict()
+            for fieldName, (localMean, localSD, localPercentileRank) in zip(modelFieldNames, resultList):
+                valueDict[fieldName + '_LocalMean'] = localMean
+                valueDict[fieldName + '_LocalSD'] = localSD
+                valueDict[fieldName + '_LocalPercentileRank'] = localPercentileRank
+            self.addPointDataArrays(polyData, valueDict)
+
+    def confirmOverwrite(self, existingFilenames):
+        #  Ask only once if the files which already exist have to be replaced
+        messageBox = ctk.ctkMessageBox()
+        messageBox.setWindowTitle('WARNING')
+        messageBox.setIcon(messageBox.Warning)
+        messageBox.setText(str(len(existingFilenames)) + ' file(s) already exist in this folder.')
+        messageBox.setInformativeText('Do you want to replace them?')
+        messageBox.setDetailedText('\n'.join(existingFilenames))
+        messageBox.setStandardButtons(messageBox.No | messageBox.Yes)
+        return messageBox.exec_() == messageBox.Yes
 
     def exportationFunction(self, directoryExport, exportCheckBoxState, ROIDict):
         directory = directoryExport.directory
@@ -606,6 +748,28 @@ class MeshStatisticsLogic(ScriptedLoadableModuleLogic):
                             ROIArray = pointData.GetArray(ROIName)
                             self.exportPointValueAsCSV(filename, fieldArray, ROIArray)
 
+    def ExportationValueMatrixOnEachPoint(self, directoryExport, ROIDict):
+        #  One file per ROI and field (Entire Model included), points as rows and models as columns
+        directory = directoryExport.directory
+        directoryPointValuesFolder = directory + '/ValuesOnEachPoint'
+        filenameDict = dict()
+        for ROIName, ROIDictValue in sorted(ROIDict.items()):
+            for fieldName in sorted(ROIDictValue.keys()):
+                filenameDict[(ROIName, fieldName)] = directoryPointValuesFolder + '/' + ROIName + '/' + fieldName + '.csv'
+        existingFilenames = [filename for filename in filenameDict.values() if os.path.exists(filename)]
+        replaceExistingFiles = not existingFilenames or self.confirmOverwrite(existingFilenames)
+
+        for (ROIName, fieldName), filename in sorted(filenameDict.items()):
+            if os.path.exists(filename) and not replaceExistingFiles:
+                continue
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            modelNames = sorted(ROIDict[ROIName][fieldName].keys())
+            pointDataList = [slicer.util.getNode(modelName).GetModelDisplayNode().GetInputPolyData().GetPointData()
+                             for modelName in modelNames]
+            pointIndices, valueMatrix = self.definePointValueMatrix(ROIName, fieldName, pointDataList)
+            self.exportPointValueMatrixAsCSV(filename, modelNames, pointIndices, valueMatrix)
+
 
 class MeshStatisticsTest(ScriptedLoadableModuleTest):
     def setUp(self):
@@ -0,0 +1,677 @@
+from __future__ import print_function
+
+#  Statistics, distances, local maps and CSV exportation of Mesh Statistics, without Slicer:
+#  only numpy is imported with this module, VTK and SciPy are imported by the functions using them,
+#  so that it can be imported and tested outside of Slicer (e.g. in worker processes)
+
+import numpy
+import io
+import math
+import csv
+import os
+import logging
+import queue
+import threading
+
+
+class MeshStatisticsCore(object):
+    class StatisticStore(object):
+        def __init__(self):
+            self.min = 0
+            self.max = 0
+            self.mean = 0
+            self.std = 0
+            self.percentile5 = 0
+            self.percentile15 = 0
+            self.percentile25 = 0
+            self.percentile50 = 0
+            self.percentile75 = 0
+            self.percentile85 = 0
+            self.percentile95 = 0
+            self.isEstimate = False
+            self.errors = dict()  # Key = name of the statistic estimated on a subsample
+                                  # Value = half width of its 95% confidence interval
+
+    class ExportPipeline(object):
+        #  Files are written by writer threads while the statistics are still being computed.
+        #  The queue of files to write is bounded: when the writers are behind, the computation
+        #  waits, so that the values waiting to be written do not accumulate in memory
+        def __init__(self, directory, exportCheckBoxState, exportPointValue, pointValueMatrix,
+                     numberOfWriters=4, maximumNumberOfPendingFiles=16):
+            self.directory = directory
+            self.separateFiles = exportCheckBoxState
+            self.exportPointValue = exportPointValue
+            self.pointValueMatrix = pointValueMatrix
+            self.numberOfWriters = numberOfWriters
+            self.queue = queue.Queue(maximumNumberOfPendingFiles)
+            self.writers = list()
+            self.errors = list()
+            self.skippedFilenames = set()
+
+        def statisticsFilename(self, ROIName, fieldName):
+            if self.separateFiles:
+                return self.directory + '/' + ROIName + '/' + fieldName + '.csv'
+            return self.directory + '/' + ROIName + '.csv'
+
+        def pointValueFilename(self, ROIName, fieldName, modelName):
+            directoryPointValuesFolder = self.directory + '/ValuesOnEachPoint/' + ROIName + '/' + fieldName
+            if self.pointValueMatrix:
+                return directoryPointValuesFolder + '.csv'
+            return directoryPointValuesFolder + '/' + modelName + '.csv'
+
+        def filenames(self, ROIDict, modelNames):
+            #  All the files which will be written, to decide before computing if existing ones are replaced
+            filenames = list()
+            for ROIName, ROIDictValue in sorted(ROIDict.items()):
+                for fieldName in sorted(ROIDictValue.keys()):
+                    filenames.append(self.statisticsFilename(ROIName, fieldName))
+                    if self.exportPointValue and self.pointValueMatrix:
+                        filenames.append(self.pointValueFilename(ROIName, fieldName, None))
+                    elif self.exportPointValue and ROIName != 'Entire Model':
+                        for modelName in modelNames:
+                            filenames.append(self.pointValueFilename(ROIName, fieldName, modelName))
+            return sorted(set(filenames))
+
+        def start(self):
+            for i in range(0, self.numberOfWriters):
+                writer = threading.Thread(target=self.write)
+                writer.daemon = True
+                writer.start()
+                self.writers.append(writer)
+
+        def write(self):
+            while True:
+                task = self.queue.get()
+                if task is None:
+                    return
+                function, args = task
+                try:
+                    function(*args)
+                except Exception as e:
+                    self.errors.append(args[0] + ': ' + str(e))
+
+        def submit(self, filename, function, *args):
+            #  function(filename, *args) is called by a writer, this blocks while the queue is full
+            if filename in self.skippedFilenames:
+                return
+            directory = os.path.dirname(filename)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.queue.put((function, (filename,) + args))
+
+        def close(self):
+            #  Wait for all the files to be written and return the errors
+            for writer in self.writers:
+                self.queue.put(None)
+            for writer in self.writers:
+                writer.join()
+            self.writers = list()
+            return self.errors
+
+    quantiles = [0.05, 0.15, 0.25, 0.50, 0.75, 0.85, 0.95]
+
+    def __init__(self, numberOfDecimals=3, decimalPoint='.', numberOfThreads=1):
+        self.numberOfDecimals = numberOfDecimals
+        self.decimalPoint = decimalPoint
+        self.numberOfThreads = numberOfThreads  # Threads used by fillStatistics on a single large array
+        self.minimumParallelSize = 1000000  # Smaller arrays are not worth splitting
+        self.previewSampleSize = 10000
+        self.maximumNeighbourhoodSize = 10000  # Average number of points in a neighbourhood above which local maps are refused
+        self.maximumNeighbourhoodBlockSize = 4000000  # Entries of the neighbourhood matrix built at once
+        self.locatorCache = dict()  # Key = target key (ID of the target model node, or address of the polydata)
+                                    # Value = (address of the polydata, MTime of its points, KD-tree built on them)
+
+    def errorDisplay(self, message):
+        #  Overridden by MeshStatisticsLogic to display the message in Slicer
+        logging.error(message)
+
+    def compareList(self, list1, list2):
+        ListInCommon = list(set(list1) & set(list2))
+        ListNotInCommon = (list(set(list1) - set(list2)) + list(set(list2) - set(list1)))
+        return ListInCommon, ListNotInCommon
+
+    def arrayToNumpy(self, array):
+        #  Return the values of a vtkDataArray as a numpy.array without copying them.
+        #  numpy.arrays (e.g. distances computed by computeDistances) are returned as they are
+        if isinstance(array, numpy.ndarray):
+            return array
+        from vtk.util import numpy_support
+        return numpy_support.vtk_to_numpy(array)
+
+    def defineArray(self, fieldArray, ROIArray):
+        #  Define array of value from fieldArray(array with all the distances from ModelToModelDistance)
+        #  using ROIArray as a mask
+        #  Return a numpy.array to be able to use numpy's method to compute statistics
+        fieldValues = self.arrayToNumpy(fieldArray)
+        if ROIArray is None:
+            return True, numpy.array(fieldValues, dtype=numpy.float64)
+        ROIValues = self.arrayToNumpy(ROIArray)
+        if len(ROIValues) != len(fieldValues):
+            print('Size of ROIArray and fieldArray are not the same!!!')
+            return False, numpy.array([])
+        return True, numpy.array(fieldValues[ROIValues == 1.0], dtype=numpy.float64)
+
+    def computeMean(self, valueArray):
+        #  valueArray is an array in which values to compute statistics on are stored
+        return round(numpy.mean(valueArray), self.numberOfDecimals)
+
+    def computeMinMax(self, valueArray):
+        #  valueArray is an array in which values to compute statistics on are stored
+        return round(numpy.min(valueArray), self.numberOfDecimals), round(numpy.max(valueArray), self.numberOfDecimals)
+
+    def computeStandardDeviation(self, valueArray):
+        #  valueArray is an array in which values to compute statistics on are stored
+        return round(numpy.std(valueArray), self.numberOfDecimals)
+
+    def computeQuantiles(self, valueArray):
+        quantile_values = numpy.quantile(valueArray, self.quantiles)
+        quantile_values = numpy.around(quantile_values, self.numberOfDecimals)
+        return quantile_values
+
+
+    def computeAll(self, fieldArray, fieldState, ROIArray):
+        #  fieldArray and ROIArray can be vtkDataArrays or numpy.arrays
+        bool, array = self.defineArray(fieldArray, ROIArray)
+        if not bool:
+            return
+        if len(array) == 0:
+            self.errorDisplay("The ROI is empty")
+            return
+        if bool:
+            self.fillStatistics(array, fieldState)
+
+    def fillStatistics(self, array, fieldState):
+        if self.numberOfThreads > 1 and len(array) >= self.minimumParallelSize:
+            minimum, maximum, mean, std, quantile_values = self.computeParallelStatistics(array)
+            fieldState.min, fieldState.max = round(minimum, self.numberOfDecimals), round(maximum, self.numberOfDecimals)
+            fieldState.mean = round(mean, self.numberOfDecimals)
+            fieldState.std = round(std, self.numberOfDecimals)
+            quantile_values = numpy.around(quantile_values, self.numberOfDecimals)
+        else:
+            fieldState.min, fieldState.max = self.computeMinMax(array)
+            fieldState.mean = self.computeMean(array)
+            fieldState.std = self.computeStandardDeviation(array)
+            quantile_values = self.computeQuantiles(array)
+
+        fieldState.percentile5 = quantile_values[0]
+        fieldState.percentile15 = quantile_values[1]
+        fieldState.percentile25 = quantile_values[2]
+        fieldState.percentile50 = quantile_values[3]
+        fieldState.percentile75 = quantile_values[4]
+        fieldState.percentile85 = quantile_values[5]
+        fieldState.percentile95 = quantile_values[6]
+
+    def defineSummationTree(self, start, size, depth):
+        #  Split [start, start + size) the way numpy's pairwise summation does (halves rounded to a multiple
+        #  of 8, no split under 128 values), so that adding the sums of the chunks following this tree gives
+        #  exactly the result of numpy.sum on the whole array
+        if depth == 0 or size <= 128:
+            return (start, start + size)
+        half = size // 2
+        half -= half % 8
+        return [self.defineSummationTree(start, half, depth - 1),
+                self.defineSummationTree(start + half, size - half, depth - 1)]
+
+    def listChunks(self, summationTree):
+        if isinstance(summationTree, tuple):
+            return [summationTree]
+        return self.listChunks(summationTree[0]) + self.listChunks(summationTree[1])
+
+    def addChunkSums(self, summationTree, chunkSums):
+        #  chunkSums: key = (start, stop) of a chunk, value = its sum
+        if isinstance(summationTree, tuple):
+            return chunkSums[summationTree]
+        return self.addChunkSums(summationTree[0], chunkSums) + self.addChunkSums(summationTree[1], chunkSums)
+
+    def selectFromSortedChunks(self, sortedChunks, rank):
+        #  Value of the given rank (starting from 0) among the values of all the sorted chunks.
+        #  The candidates of each chunk are the range [lower, upper), narrowed around the weighted median of
+        #  their middle values: at least a quarter of the candidates are discarded at each iteration
+        lower = [0] * len(sortedChunks)
+        upper = [len(chunk) for chunk in sortedChunks]
+        while True:
+            numberOfCandidates = sum(upper) - sum(lower)
+            if numberOfCandidates <= 1024:
+                candidates = numpy.concatenate([chunk[lower[i]:upper[i]] for i, chunk in enumerate(sortedChunks)])
+                return numpy.partition(candidates, rank)[rank]
+            middles = sorted([(chunk[(lower[i] + upper[i]) // 2], upper[i] - lower[i])
+                              for i, chunk in enumerate(sortedChunks) if upper[i] > lower[i]])
+            weight = 0
+            for pivot, numberOfValues in middles:
+                weight += numberOfValues
+                if 2 * weight >= numberOfCandidates:
+                    break
+            below = [lower[i] + numpy.searchsorted(chunk[lower[i]:upper[i]], pivot, 'left')
+                     for i, chunk in enumerate(sortedChunks)]
+            notAbove = [lower[i] + numpy.searchsorted(chunk[lower[i]:upper[i]], pivot, 'right')
+                        for i, chunk in enumerate(sortedChunks)]
+            numberBelow = sum(below) - sum(lower)
+            numberEqual = sum(notAbove) - sum(below)
+            if rank < numberBelow:
+                upper = below
+            elif rank < numberBelow + numberEqual:
+                return pivot
+            else:
+                rank -= numberBelow + numberEqual
+                lower = notAbove
+
+    def computeParallelStatistics(self, valueArray):
+        #  Minimum, maximum, mean, standard deviation and quantiles of valueArray (not rounded), computed on
+        #  chunks by self.numberOfThreads threads (numpy releases the GIL) and combined so that the results
+        #  are exactly the ones of numpy.min, numpy.max, numpy.mean, numpy.std and numpy.quantile
+        from concurrent.futures import ThreadPoolExecutor
+        numberOfValues = len(valueArray)
+        summationTree = self.defineSummationTree(0, numberOfValues, int(math.ceil(math.log(self.numberOfThreads, 2))))
+        chunks = self.listChunks(summationTree)
+        with ThreadPoolExecutor(self.numberOfThreads) as pool:
+            minimum = numpy.min(list(pool.map(lambda chunk: numpy.min(valueArray[chunk[0]:chunk[1]]), chunks)))
+            maximum = numpy.max(list(pool.map(lambda chunk: numpy.max(valueArray[chunk[0]:chunk[1]]), chunks)))
+            chunkSums = dict(zip(chunks, pool.map(lambda chunk: numpy.sum(valueArray[chunk[0]:chunk[1]]), chunks)))
+            mean = self.addChunkSums(summationTree, chunkSums) / numberOfValues
+            if numpy.isnan(mean):
+                #  The order of the NaN is not defined when selecting the quantiles
+                return numpy.min(valueArray), numpy.max(valueArray), mean, numpy.std(valueArray), \
+                       numpy.quantile(valueArray, self.quantiles)
+
+            def sumOfSquaredDeviations(chunk):
+                deviations = valueArray[chunk[0]:chunk[1]] - mean
+                return numpy.sum(numpy.multiply(deviations, deviations, out=deviations))
+            chunkSums = dict(zip(chunks, pool.map(sumOfSquaredDeviations, chunks)))
+            std = numpy.sqrt(self.addChunkSums(summationTree, chunkSums) / numberOfValues)
+            sortedChunks = list(pool.map(lambda chunk: numpy.sort(valueArray[chunk[0]:chunk[1]]), chunks))
+
+        #  Linear interpolation between the two closest ranks, as numpy.quantile does
+        virtualIndices = (numberOfValues - 1) * numpy.asarray(self.quantiles)
+        previousIndices = numpy.floor(virtualIndices).astype(numpy.int64)
+        gamma = virtualIndices - previousIndices
+        nextIndices = numpy.minimum(previousIndices + 1, numberOfValues - 1)
+        values = dict([(rank, self.selectFromSortedChunks(sortedChunks, rank))
+                       for rank in set(previousIndices.tolist() + nextIndices.tolist())])
+        previousValues = numpy.array([values[rank] for rank in previousIndices])
+        nextValues = numpy.array([values[rank] for rank in nextIndices])
+        difference = numpy.subtract(nextValues, previousValues)
+        quantile_values = numpy.add(previousValues, difference * gamma)
+        numpy.subtract(nextValues, difference * (1 - gamma), out=quantile_values, where=gamma >= 0.5)
+        return minimum, maximum, mean, std, quantile_values
+
+    def computeEstimate(self, fieldArray, fieldState, ROIArray, sampleSize, seed=0):
+        #  Estimate the statistics on sampleSize values of the ROI drawn at random (always the same ones for
+        #  a given seed) and store the half width of the 95% confidence interval of the mean, the standard
+        #  deviation and the percentiles in fieldState.errors. The ROI is not checked, computeAll will do it.
+        #  The indices of the sample are drawn first so that only the sampled values are copied
+        fieldValues = self.arrayToNumpy(fieldArray)
+        ROIIndices = None
+        numberOfValues = len(fieldValues)
+        if ROIArray is not None:
+            ROIValues = self.arrayToNumpy(ROIArray)
+            if len(ROIValues) != len(fieldValues):
+                return
+            ROIIndices = numpy.flatnonzero(ROIValues == 1.0)
+            numberOfValues = len(ROIIndices)
+        if numberOfValues == 0:
+            return
+        if numberOfValues <= sampleSize:
+            bool, array = self.defineArray(fieldArray, ROIArray)
+            self.fillStatistics(array, fieldState)
+            return
+        sampleIndices = numpy.random.default_rng(seed).choice(numberOfValues, sampleSize, replace=False)
+        if ROIIndices is not None:
+            sampleIndices = ROIIndices[sampleIndices]
+        sample = numpy.array(fieldValues[sampleIndices], dtype=numpy.float64)
+        self.fillStatistics(sample, fieldState)
+        fieldState.isEstimate = True
+
+        #  Finite population correction: the sample is drawn without replacement
+        correction = math.sqrt(float(numberOfValues - sampleSize) / (numberOfValues - 1))
+        std = numpy.std(sample)
+        fieldState.errors['mean'] = round(1.96 * std / math.sqrt(sampleSize) * correction, self.numberOfDecimals)
+        fieldState.errors['std'] = round(1.96 * std / math.sqrt(2.0 * (sampleSize - 1)) * correction,
+                                         self.numberOfDecimals)
+        #  Confidence interval of a percentile given by the order statistics of the sample around its rank
+        sortedSample = numpy.sort(sample)
+        for percentile in [5, 15, 25, 50, 75, 85, 95]:
+            p = percentile / 100.0
+            halfWidth = 1.96 * math.sqrt(sampleSize * p * (1.0 - p))
+            lower = sortedSample[max(0, int(math.floor(sampleSize * p - halfWidth)))]
+            upper = sortedSample[min(sampleSize - 1, int(math.ceil(sampleSize * p + halfWidth)))]
+            fieldState.errors['percentile' + str(percentile)] = round((upper - lower) / 2.0 * correction,
+                                                                      self.numberOfDecimals)
+
+    def getPointCoordinates(self, polyData):
+        from vtk.util import numpy_support
+        return numpy.array(numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()), dtype=numpy.float64)
+
+    def getPointNormals(self, polyData):
+        #  Use the normals stored in the polydata, or compute them without splitting
+        #  the sharp edges so that there is still one normal per point
+        import vtk
+        from vtk.util import numpy_support
+        normals = polyData.GetPointData().GetNormals()
+        if normals is None:
+            normalFilter = vtk.vtkPolyDataNormals()
+            normalFilter.SetInputData(polyData)
+            normalFilter.ComputePointNormalsOn()
+            normalFilter.ComputeCellNormalsOff()
+            normalFilter.SplittingOff()
+            normalFilter.Update()
+            normals = normalFilter.GetOutput().GetPointData().GetNormals()
+        return numpy.array(numpy_support.vtk_to_numpy(normals), dtype=numpy.float64)
+
+    def getTargetLocator(self, targetPolyData, targetKey=None):
+        #  The KD-tree is built once per target and only rebuilt if its polydata or its points have changed.
+        #  Only one tree is kept per targetKey, so the tree of a replaced mesh is released
+        from scipy.spatial import cKDTree
+        address = targetPolyData.GetAddressAsString('vtkPolyData')
+        if targetKey is None:
+            targetKey = address
+        pointsMTime = targetPolyData.GetPoints().GetMTime()
+        if targetKey in self.locatorCache:
+            cachedAddress, MTime, tree = self.locatorCache[targetKey]
+            if cachedAddress == address and MTime == pointsMTime:
+                return tree
+        tree = cKDTree(self.getPointCoordinates(targetPolyData))
+        self.locatorCache[targetKey] = (address, pointsMTime, tree)
+        return tree
+
+    def computeDistances(self, sourcePolyData, targetPolyData, correspondingPoints=False, targetKey=None):
+        #  Compute the distances from each point of sourcePolyData to targetPolyData, either to the
+        #  closest point of the target (nearest neighbours queried all at once in a KD-tree) or to the
+        #  point with the same index in the target.
+        #  The signed distance is positive when the target is in the direction of the source normal.
+        #  Return a dictionary (key = name of the field, value = numpy.array), or None if the
+        #  corresponding points can not be defined
+        sourcePoints = self.getPointCoordinates(sourcePolyData)
+        if correspondingPoints:
+            targetPoints = self.getPointCoordinates(targetPolyData)
+            if len(targetPoints) != len(sourcePoints):
+                print('Number of points of the source and the target are not the same!!!')
+                return None
+        else:
+            tree = self.getTargetLocator(targetPolyData, targetKey)
+            _, indices = tree.query(sourcePoints, workers=-1)
+            targetPoints = tree.data[indices]
+        vectors = targetPoints - sourcePoints
+        absoluteDistances = numpy.sqrt(numpy.einsum('ij,ij->i', vectors, vectors))
+        normals = self.getPointNormals(sourcePolyData)
+        signs = numpy.where(numpy.einsum('ij,ij->i', vectors, normals) < 0, -1.0, 1.0)
+        return {'AbsolutePointToPointDistance': absoluteDistances,
+                'SignedPointToPointDistance': signs * absoluteDistances,
+                'PointToPointAlongX': vectors[:, 0],
+                'PointToPointAlongY': vectors[:, 1],
+                'PointToPointAlongZ': vectors[:, 2]}
+
+    def addPointDataArrays(self, polyData, valueDict):
+        #  Store the values (e.g. distances) as point data so they are available as fields,
+        #  an existing array with the same name is replaced
+        import vtk
+        from vtk.util import numpy_support
+        for fieldName, values in valueDict.items():
+            array = numpy_support.numpy_to_vtk(values, deep=1, array_type=vtk.VTK_DOUBLE)
+            array.SetName(fieldName)
+            polyData.GetPointData().AddArray(array)
+        polyData.Modified()
+
+    def defineAdjacencyMatrix(self, polyData):
+        #  Sparse adjacency matrix of the points of polyData (scipy.sparse.csr_matrix, 1 where two points
+        #  share an edge), built from the cells once triangulated
+        import scipy.sparse
+        import vtk
+        from vtk.util import numpy_support
+        triangleFilter = vtk.vtkTriangleFilter()
+        triangleFilter.SetInputData(polyData)
+        triangleFilter.PassVertsOff()
+        triangleFilter.PassLinesOff()
+        triangleFilter.Update()
+        triangles = numpy_support.vtk_to_numpy(triangleFilter.GetOutput().GetPolys().GetConnectivityArray()).reshape(-1, 3)
+        rows = numpy.concatenate((triangles[:, 0], triangles[:, 1], triangles[:, 2]))
+        columns = numpy.concatenate((triangles[:, 1], triangles[:, 2], triangles[:, 0]))
+        numberOfPoints = polyData.GetNumberOfPoints()
+        adjacencyMatrix = scipy.sparse.csr_matrix((numpy.ones(2 * len(rows), dtype=numpy.float32),
+                                                   (numpy.concatenate((rows, columns)), numpy.concatenate((columns, rows)))),
+                                                  shape=(numberOfPoints, numberOfPoints))
+        adjacencyMatrix.data[:] = 1.0  # edges shared by two triangles have been summed
+        return adjacencyMatrix
+
+    def defineNeighbourhoodFunction(self, polyData, numberOfRings=1, radius=0.0):
+        #  Return two functions on an array of point indices:
+        #  - the sparse matrix (scipy.sparse.csr_matrix) with a row per point and a 1 in the column j if
+        #    the point j is in its neighbourhood (the point included), only built for these points
+        #  - the number of points in the neighbourhood of each point, computed without building its rows
+        #  The neighbourhood is:
+        #  - the points at most numberOfRings edges away from the point if radius is 0
+        #  - otherwise the points closer than radius to the point, the euclidean ball approximating
+        #    the geodesic one (a shortest path search from each point is not tractable on large meshes)
+        import scipy.sparse
+        numberOfPoints = polyData.GetNumberOfPoints()
+        if radius > 0:
+            from scipy.spatial import cKDTree
+            points = self.getPointCoordinates(polyData)
+            tree = cKDTree(points)
+
+            def neighbourhoodRows(pointIndices):
+                pairs = cKDTree(points[pointIndices]).sparse_distance_matrix(tree, radius, output_type='ndarray')
+                return scipy.sparse.csr_matrix((numpy.ones(len(pairs), dtype=numpy.float32), (pairs['i'], pairs['j'])),
+                                               shape=(len(pointIndices), numberOfPoints))
+
+            def neighbourhoodSizes(pointIndices):
+                return tree.query_ball_point(points[pointIndices], radius, return_length=True)
+
+            return neighbourhoodRows, neighbourhoodSizes
+
+        identity = scipy.sparse.identity(numberOfPoints, dtype=numpy.float32, format='csr')
+        ringMatrix = (self.defineAdjacencyMatrix(polyData) + identity).tocsr()
+
+        def neighbourhoodRows(pointIndices):
+            rows = ringMatrix[pointIndices]
+            for i in range(1, numberOfRings):
+                rows = (rows * ringMatrix).tocsr()
+                rows.data[:] = 1.0  # only keep if a point is reached, not by how many paths
+            return rows
+
+        def neighbourhoodSizes(pointIndices):
+            return numpy.diff(neighbourhoodRows(pointIndices).indptr)
+
+        return neighbourhoodRows, neighbourhoodSizes
+
+    def computeNeighbourhoodStatistics(self, polyData, fieldArrayList, numberOfRings=1, radius=0.0):
+        #  Local mean, standard deviation and percentile rank of the value of each point within its
+        #  neighbourhood, for each field of fieldArrayList: list of (localMean, localSD, localPercentileRank).
+        #  The rows of the neighbourhood matrix are built and used by blocks of points, sharing them between
+        #  the fields, so that the memory used stays bounded by maximumNeighbourhoodBlockSize entries.
+        #  Return None if the neighbourhoods are larger than maximumNeighbourhoodSize points on average
+        numberOfPoints = polyData.GetNumberOfPoints()
+        neighbourhoodRows, neighbourhoodSizes = self.defineNeighbourhoodFunction(polyData, numberOfRings, radius)
+        samplePointIndices = numpy.unique(numpy.linspace(0, numberOfPoints - 1, min(numberOfPoints, 100)).astype(numpy.int64))
+        averageNeighbourhoodSize = float(numpy.mean(neighbourhoodSizes(samplePointIndices)))
+        if averageNeighbourhoodSize > self.maximumNeighbourhoodSize:
+            self.errorDisplay('The neighbourhoods contain about ' + str(int(averageNeighbourhoodSize)) +
+                              ' points, more than ' + str(self.maximumNeighbourhoodSize) +
+                              ': use fewer rings or a smaller radius')
+            return None
+        numberOfPointsPerBlock = max(1, int(self.maximumNeighbourhoodBlockSize / max(averageNeighbourhoodSize, 1.0)))
+
+        valueList = list()
+        meanList = list()
+        centeredValueList = list()
+        resultList = list()
+        for fieldArray in fieldArrayList:
+            values = numpy.array(self.arrayToNumpy(fieldArray), dtype=numpy.float64).ravel()
+            valueList.append(values)
+            meanList.append(numpy.mean(values))  # subtracted to limit the cancellation when computing the variance
+            centeredValues = values - meanList[-1]
+            centeredValueList.append((centeredValues, centeredValues ** 2))
+            resultList.append((numpy.empty(numberOfPoints), numpy.empty(numberOfPoints), numpy.empty(numberOfPoints)))
+        for start in range(0, numberOfPoints, numberOfPointsPerBlock):
+            stop = min(start + numberOfPointsPerBlock, numberOfPoints)
+            blockMatrix = neighbourhoodRows(numpy.arange(start, stop))
+            numberOfNeighbours = numpy.diff(blockMatrix.indptr).astype(numpy.float64)
+            rows = numpy.repeat(numpy.arange(stop - start), numpy.diff(blockMatrix.indptr))
+            for values, mean, (centeredValues, squaredCenteredValues), (localMean, localSD, localPercentileRank) \
+                    in zip(valueList, meanList, centeredValueList, resultList):
+                blockMean = blockMatrix.dot(centeredValues) / numberOfNeighbours
+                blockVariance = blockMatrix.dot(squaredCenteredValues) / numberOfNeighbours - blockMean ** 2
+                localMean[start:stop] = blockMean + mean
+                localSD[start:stop] = numpy.sqrt(numpy.maximum(blockVariance, 0.0))
+                neighbourValues = values[blockMatrix.indices]
+                pointValues = values[start:stop][rows]
+                numberBelow = numpy.bincount(rows, weights=neighbourValues < pointValues, minlength=stop - start)
+                numberEqual = numpy.bincount(rows, weights=neighbourValues == pointValues, minlength=stop - start)
+                localPercentileRank[start:stop] = 100.0 * (numberBelow + 0.5 * numberEqual) / numberOfNeighbours
+        return resultList
+
+    def stackTimepoints(self, arrayList):
+        #  Matrix of the values of corresponding points (rows) at each timepoint (columns)
+        #  Return False if the arrays do not have the same number of points
+        valueList = [numpy.asarray(self.arrayToNumpy(array), dtype=numpy.float64).ravel() for array in arrayList]
+        if len(set([len(values) for values in valueList])) != 1:
+            print('Number of points of the timepoints are not the same!!!')
+            return False, numpy.array([])
+        return True, numpy.column_stack(valueList)
+
+    def defineDisplacementMatrix(self, polyDataList):
+        #  Signed displacement of each point from the first timepoint, along the normal of the first timepoint
+        pointList = [self.getPointCoordinates(polyData) for polyData in polyDataList]
+        if len(set([len(points) for points in pointList])) != 1:
+            print('Number of points of the timepoints are not the same!!!')
+            return False, numpy.array([])
+        normals = self.getPointNormals(polyDataList[0])
+        displacements = numpy.stack(pointList, axis=1) - pointList[0][:, numpy.newaxis, :]
+        return True, numpy.einsum('itj,ij->it', displacements, normals)
+
+    def defineLongitudinalFields(self, fieldName, valueMatrix, times):
+        #  Per point change between consecutive timepoints, growth rate (change per unit of time), least
+        #  squares slope over all the timepoints and total change, computed on all the points at once.
+        #  Return a list of (name, numpy.array) where names are fieldName_Change_1_2, fieldName_GrowthRate_1_2, ...
+        times = numpy.asarray(times, dtype=numpy.float64)
+        changes = numpy.diff(valueMatrix, axis=1)
+        growthRates = changes / numpy.diff(times)
+        centeredTimes = times - numpy.mean(times)
+        slopes = valueMatrix.dot(centeredTimes) / centeredTimes.dot(centeredTimes)
+        longitudinalFields = list()
+        for i in range(0, changes.shape[1]):
+            longitudinalFields.append(('%s_Change_%d_%d' % (fieldName, i + 1, i + 2), changes[:, i]))
+        for i in range(0, growthRates.shape[1]):
+            longitudinalFields.append(('%s_GrowthRate_%d_%d' % (fieldName, i + 1, i + 2), growthRates[:, i]))
+        longitudinalFields.append((fieldName + '_Slope', slopes))
+        longitudinalFields.append((fieldName + '_TotalChange', valueMatrix[:, -1] - valueMatrix[:, 0]))
+        return longitudinalFields
+
+    def writeFieldFile(self, fileWriter, modelDict):
+        #  Function defined to export all statistics of a field concidering a file writer (fileWriter)
+        #  and a dictionary of models (modelDict) where statistics are stored
+        for shapeName, shapeStats in modelDict.items():
+            fileWriter.writerow([shapeName,
+                                 shapeStats.min,
+                                 shapeStats.max,
+                                 shapeStats.mean,
+                                 shapeStats.std,
+                                 shapeStats.percentile5,
+                                 shapeStats.percentile15,
+                                 shapeStats.percentile25,
+                                 shapeStats.percentile50,
+                                 shapeStats.percentile75,
+                                 shapeStats.percentile85,
+                                 shapeStats.percentile95])
+
+    def exportAllAsCSV(self, filename, ROIName, ROIDictValue):
+        #  Export all fields on the same csv file considering a region
+        file = open(filename, 'w')
+        cw = csv.writer(file, delimiter=',')
+        cw.writerow([ROIName])
+        cw.writerow([' '])
+        for fieldName, shapeDict in sorted(ROIDictValue.items()):
+            cw.writerow([fieldName])
+            cw.writerow(['Model','Min','Max','Mean','SD','Per5','Per15','Per25','Per50','Per75','Per85','Per95'])
+            self.writeFieldFile(cw, shapeDict)
+            cw.writerow([' '])
+        file.close()
+        if self.decimalPoint != '.':
+            self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
+            self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
+
+    def exportFieldAsCSV(self, filename, fieldName, shapeDict):
+        #  Export fields on different csv files
+        file = open(filename, 'w')
+        cw = csv.writer(file, delimiter=',')
+        cw.writerow([fieldName])
+        cw.writerow(['Model','Min','Max','Mean','SD','Per5','Per15','Per25','Per50','Per75','Per85','Per95'])
+        self.writeFieldFile(cw, shapeDict)
+        file.close()
+        if self.decimalPoint != '.':
+            self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
+            self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
+
+    
+    def exportPointValueAsCSV(self, filename, fieldArray, ROIArray):
+        #Exportation of the value stored for each point:
+        bool, arrayToReturn = self.defineArray(fieldArray, ROIArray)
+        if len(arrayToReturn) == 0:
+            self.errorDisplay("The ROI is empty")
+            return
+        if bool:
+            self.writePointValueFile(filename, arrayToReturn)
+
+    def writePointValueFile(self, filename, valueArray):
+        file = open(filename, 'w')
+        cw = csv.writer(file, delimiter=',')
+        for value in valueArray:
+            cw.writerow([value])
+        file.close()
+        if self.decimalPoint != '.':
+            self.replaceCharac(filename, ',', ';') # change the Delimiter and put a semicolon instead of a comma
+            self.replaceCharac(filename, '.', self.decimalPoint) # change the decimal separator '.' for a comma
+
+
+    def definePointValueMatrix(self, ROIName, fieldName, pointDataList):
+        #  Align the values of fieldName of each point data of pointDataList in one matrix:
+        #  one row per point index and one column per model, numpy.nan where the point is not in the ROI.
+        #  Only the points in the ROI of at least one model are kept.
+        #  Return the indices of the points kept and the matrix of their values
+        valueList = list()
+        for pointData in pointDataList:
+            fieldValues = self.arrayToNumpy(pointData.GetArray(fieldName))
+            if ROIName == 'Entire Model':
+                mask = numpy.ones(len(fieldValues), dtype=bool)
+            else:
+                ROIValues = self.arrayToNumpy(pointData.GetArray(ROIName))
+                if len(ROIValues) != len(fieldValues):
+                    print('Size of ROIArray and fieldArray are not the same!!!')
+                    mask = numpy.zeros(len(fieldValues), dtype=bool)
+                else:
+                    mask = ROIValues == 1.0
+            valueList.append((fieldValues, mask))
+
+        numberOfPoints = max([len(fieldValues) for fieldValues, mask in valueList] + [0])
+        valueMatrix = numpy.full((numberOfPoints, len(valueList)), numpy.nan)
+        for column, (fieldValues, mask) in enumerate(valueList):
+            valueMatrix[:len(fieldValues), column][mask] = fieldValues[mask]
+        pointIndices = numpy.flatnonzero(~numpy.all(numpy.isnan(valueMatrix), axis=1))
+        return pointIndices, valueMatrix[pointIndices]
+
+    def exportPointValueMatrixAsCSV(self, filename, modelNames, pointIndices, valueMatrix, numberOfRowsPerBlock=10000):
+        #  Exportation of the values on each point of all the models in one file:
+        #  the matrix is formatted and written by blocks of rows, with all the digits of the values
+        #  (as the files of each model), empty cells are points outside the ROI
+        delimiter = ',' if self.decimalPoint == '.' else ';'
+        with open(filename, 'w') as file:
+            csv.writer(file, delimiter=delimiter, lineterminator='\n').writerow(['PointIndex'] + list(modelNames))
+            for start in range(0, len(pointIndices), numberOfRowsPerBlock):
+                stop = start + numberOfRowsPerBlock
+                buffer = io.StringIO()
+                numpy.savetxt(buffer, numpy.column_stack((pointIndices[start:stop], valueMatrix[start:stop])),
+                              fmt=['%d'] + ['%.17g'] * len(modelNames), delimiter=delimiter)
+                values = buffer.getvalue().replace('nan', '')
+                if self.decimalPoint != '.':
+                    values = values.replace('.', self.decimalPoint)  # change the decimal separator '.' for a comma
+                file.write(values)
+
+    def replaceCharac(self, filename, oldCharac, newCharac):
+        #  Function to replace a charactere (oldCharac) in a file (filename) by a new one (newCharac)
+        file = open(filename,'r')
+        lines = file.readlines()
+        with open(filename, 'r') as file:
+            lines = [line.replace(oldCharac, newCharac) for line in file.readlines()]
+        file.close()
+        file = open(filename, 'w')
+        file.writelines(lines)
+        file.close()
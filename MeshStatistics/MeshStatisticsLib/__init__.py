@@ -0,0 +1 @@
+from .MeshStatisticsCore import MeshStatisticsCore
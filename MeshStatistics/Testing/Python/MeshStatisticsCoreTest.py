@@ -0,0 +1,282 @@
+import csv
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from MeshStatisticsLib import MeshStatisticsCore
+
+try:
+    import vtk
+except ImportError:
+    vtk = None
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+
+class MeshStatisticsCoreTest(unittest.TestCase):
+    #  Tests of the statistics and exportation without Slicer and without downloading data
+    def setUp(self):
+        self.core = MeshStatisticsCore()
+
+    def defineArrays(self, firstValue, lastValue):
+        arrayValue = numpy.arange(firstValue, lastValue, dtype=numpy.float64)
+        bool, array = self.core.defineArray(arrayValue, numpy.ones(len(arrayValue)))
+        self.assertTrue(bool)
+        return array
+
+    def testImportWithoutSlicer(self):
+        code = ('import sys; from MeshStatisticsLib import MeshStatisticsCore; '
+                'sys.exit(len(set(["vtk", "qt", "ctk", "slicer", "scipy"]) & set(sys.modules)))')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')), 0)
+
+    def testStorageValue(self):
+        arrayValue = numpy.repeat(numpy.arange(0, 1000, 2, dtype=numpy.float64), 2)
+        arrayMask = numpy.zeros(len(arrayValue))
+        listOfRandomNumber = sorted(set([random.randint(0, 998) for i in range(0, 250)]))
+        arrayMask[listOfRandomNumber] = 1.0
+        bool, array = self.core.defineArray(arrayValue, arrayMask)
+        self.assertTrue(bool)
+        self.assertEqual(sorted(array), [arrayValue[i] for i in listOfRandomNumber])
+
+        bool, array = self.core.defineArray(arrayValue, arrayMask[:-1])
+        self.assertFalse(bool)
+
+    def testMinMaxMeanFunctions(self):
+        array = self.defineArrays(1, 1001)
+        self.assertEqual(self.core.computeMinMax(array), (1.0, 1000.0))
+        self.assertEqual(self.core.computeMean(array), 500.5)
+        self.assertEqual(self.core.computeStandardDeviation(array), 288.675)
+
+    def testPercentileFunction(self):
+        # odd number of value:
+        array = self.defineArrays(0, 1001)
+        self.assertEqual(tuple(self.core.computeQuantiles(array)), (50, 150, 250, 500, 750, 850, 950))
+        # even number of value:
+        array = self.defineArrays(1, 1001)
+        self.assertEqual(tuple(self.core.computeQuantiles(array)),
+                         (50.95, 150.85, 250.75, 500.50, 750.25, 850.15, 950.05))
+
+    def testParallelStatistics(self):
+        parallelCore = MeshStatisticsCore(numberOfThreads=4)
+        randomGenerator = numpy.random.default_rng(0)
+        for array in [randomGenerator.standard_normal(1000003) * 100.0,
+                      randomGenerator.integers(0, 5, 100001).astype(numpy.float64),
+                      numpy.full(1001, 3.3), numpy.arange(1, 1001, dtype=numpy.float64)]:
+            minimum, maximum, mean, std, quantile_values = parallelCore.computeParallelStatistics(array)
+            self.assertEqual((minimum, maximum, mean, std),
+                             (numpy.min(array), numpy.max(array), numpy.mean(array), numpy.std(array)))
+            self.assertEqual(quantile_values.tolist(), numpy.quantile(array, self.core.quantiles).tolist())
+
+        parallelCore.minimumParallelSize = 0
+        parallelStore = MeshStatisticsCore.StatisticStore()
+        parallelCore.computeAll(array, parallelStore, None)
+        store = MeshStatisticsCore.StatisticStore()
+        self.core.computeAll(array, store, None)
+        self.assertEqual(parallelStore.__dict__, store.__dict__)
+
+    def testEstimate(self):
+        array = numpy.arange(0, 100000, dtype=numpy.float64)
+        estimate = MeshStatisticsCore.StatisticStore()
+        self.core.computeEstimate(array, estimate, None, 1000)
+        exact = MeshStatisticsCore.StatisticStore()
+        self.core.computeAll(array, exact, None)
+        self.assertTrue(estimate.isEstimate)
+        self.assertFalse(exact.isEstimate)
+        for statisticName, error in estimate.errors.items():
+            self.assertLessEqual(abs(getattr(estimate, statisticName) - getattr(exact, statisticName)), error,
+                                 statisticName)
+
+        sameEstimate = MeshStatisticsCore.StatisticStore()
+        self.core.computeEstimate(array, sameEstimate, None, 1000)
+        self.assertEqual(sameEstimate.__dict__, estimate.__dict__)
+        smallEstimate = MeshStatisticsCore.StatisticStore()
+        self.core.computeEstimate(array, smallEstimate, None, len(array))
+        self.assertFalse(smallEstimate.isEstimate)
+        self.assertEqual(smallEstimate.mean, exact.mean)
+        self.assertEqual(smallEstimate.percentile95, exact.percentile95)
+
+    def testLongitudinalChange(self):
+        times = [0.0, 1.0, 3.0]
+        offsets = numpy.arange(0, 100, dtype=numpy.float64)
+        rates = numpy.linspace(-1.0, 1.0, 100)
+        bool, valueMatrix = self.core.stackTimepoints([offsets + rates * time for time in times])
+        self.assertTrue(bool)
+        self.assertEqual(valueMatrix.shape, (100, 3))
+        longitudinalFields = dict(self.core.defineLongitudinalFields('Field', valueMatrix, times))
+        self.assertEqual(sorted(longitudinalFields.keys()),
+                         ['Field_Change_1_2', 'Field_Change_2_3', 'Field_GrowthRate_1_2', 'Field_GrowthRate_2_3',
+                          'Field_Slope', 'Field_TotalChange'])
+        numpy.testing.assert_allclose(longitudinalFields['Field_Change_2_3'], 2.0 * rates, atol=1e-12)
+        numpy.testing.assert_allclose(longitudinalFields['Field_GrowthRate_2_3'], rates, atol=1e-12)
+        numpy.testing.assert_allclose(longitudinalFields['Field_Slope'], rates, atol=1e-12)
+        numpy.testing.assert_allclose(longitudinalFields['Field_TotalChange'], 3.0 * rates, atol=1e-12)
+
+        bool, valueMatrix = self.core.stackTimepoints([offsets, offsets[:-1]])
+        self.assertFalse(bool)
+
+    @unittest.skipIf(vtk is None, 'VTK is not available')
+    def testDisplacementMatrix(self):
+        polyDataList = list()
+        for time in [0.0, 1.0, 2.0]:
+            sphere = vtk.vtkSphereSource()
+            sphere.SetRadius(10.0 + time)
+            sphere.Update()
+            polyDataList.append(sphere.GetOutput())
+        bool, displacementMatrix = self.core.defineDisplacementMatrix(polyDataList)
+        self.assertTrue(bool)
+        longitudinalFields = dict(self.core.defineLongitudinalFields('Displacement', displacementMatrix, [0, 1, 2]))
+        numpy.testing.assert_allclose(longitudinalFields['Displacement_Slope'], 1.0, atol=1e-6)
+        numpy.testing.assert_allclose(longitudinalFields['Displacement_TotalChange'], 2.0, atol=1e-6)
+
+    def testExportPipeline(self):
+        directory = tempfile.mkdtemp()
+        exportPipeline = MeshStatisticsCore.ExportPipeline(directory, True, False, False,
+                                                           numberOfWriters=2, maximumNumberOfPendingFiles=2)
+        ROIDict = dict()
+        ROIDict['Entire Model'] = dict()
+        for i in range(0, 20):
+            ROIDict['Entire Model']['Field' + str(i)] = {'Model': MeshStatisticsCore.StatisticStore()}
+        self.assertEqual(len(exportPipeline.filenames(ROIDict, ['Model'])), 20)
+        exportPipeline.skippedFilenames = set([exportPipeline.statisticsFilename('Entire Model', 'Field0')])
+        exportPipeline.start()
+        for fieldName, modelDict in ROIDict['Entire Model'].items():
+            exportPipeline.submit(exportPipeline.statisticsFilename('Entire Model', fieldName),
+                                  self.core.exportFieldAsCSV, fieldName, modelDict)
+        self.assertEqual(exportPipeline.close(), [])
+        writtenFilenames = os.listdir(os.path.join(directory, 'Entire Model'))
+        self.assertEqual(len(writtenFilenames), 19)
+        self.assertNotIn('Field0.csv', writtenFilenames)
+
+    @unittest.skipIf(vtk is None, 'VTK is not available')
+    def testPointValueMatrix(self):
+        pointDataList = list()
+        for offset in [0, 100]:
+            polyData = vtk.vtkPolyData()
+            arrayValue = vtk.vtkDoubleArray()
+            arrayValue.SetName('Field')
+            arrayMask = vtk.vtkDoubleArray()
+            arrayMask.SetName('Field_ROI')
+            for i in range(0, 10):
+                arrayValue.InsertNextValue(offset + i)
+                arrayMask.InsertNextValue(1.0 if (i + offset // 100) % 2 == 0 else 0.0)
+            polyData.GetPointData().AddArray(arrayValue)
+            polyData.GetPointData().AddArray(arrayMask)
+            pointDataList.append(polyData.GetPointData())
+
+        pointIndices, valueMatrix = self.core.definePointValueMatrix('Entire Model', 'Field', pointDataList)
+        self.assertEqual(pointIndices.tolist(), list(range(0, 10)))
+        self.assertEqual(valueMatrix[:, 1].tolist(), list(range(100, 110)))
+        pointIndices, valueMatrix = self.core.definePointValueMatrix('Field_ROI', 'Field', pointDataList)
+        self.assertEqual(pointIndices.tolist(), list(range(0, 10)))
+        self.assertEqual(valueMatrix[0, 0], 0)
+        self.assertTrue(numpy.isnan(valueMatrix[0, 1]))
+        self.assertEqual(valueMatrix[1, 1], 101)
+
+        filename = os.path.join(tempfile.mkdtemp(), 'Field.csv')
+        self.core.exportPointValueMatrixAsCSV(filename, ['Model1', 'Model2'], pointIndices, valueMatrix)
+        with open(filename, 'r') as file:
+            lines = file.read().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[:3], ['PointIndex,Model1,Model2', '0,0,', '1,,101'])
+
+        # written by blocks, with all the digits of the values and quoted model names
+        valueMatrix = numpy.array([[0.1234567890123456, numpy.nan]] * 25)
+        self.core.exportPointValueMatrixAsCSV(filename, ['Model,1', 'Model2'], numpy.arange(0, 25), valueMatrix,
+                                              numberOfRowsPerBlock=10)
+        with open(filename, 'r') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], ['PointIndex', 'Model,1', 'Model2'])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual(rows[25][0], '24')
+        self.assertEqual(float(rows[25][1]), 0.1234567890123456)
+        self.assertEqual(rows[25][2], '')
+
+    @unittest.skipIf(vtk is None or scipy is None, 'VTK or SciPy is not available')
+    def testDistanceComputation(self):
+        sphere = vtk.vtkSphereSource()
+        sphere.SetRadius(10.0)
+        sphere.SetThetaResolution(30)
+        sphere.SetPhiResolution(30)
+        sphere.Update()
+        transform = vtk.vtkTransform()
+        transform.Translate(0.0, 0.0, 1.0)
+        transformFilter = vtk.vtkTransformPolyDataFilter()
+        transformFilter.SetInputConnection(sphere.GetOutputPort())
+        transformFilter.SetTransform(transform)
+        transformFilter.Update()
+        source = sphere.GetOutput()
+        target = transformFilter.GetOutput()
+
+        distances = self.core.computeDistances(source, target, correspondingPoints=True)
+        store = MeshStatisticsCore.StatisticStore()
+        self.core.computeAll(distances['PointToPointAlongZ'], store, None)
+        self.assertEqual((store.min, store.max, store.mean), (1.0, 1.0, 1.0))
+        # the target is moved along +z: positive where the source normal points up, negative where it points down
+        normalsZ = self.core.getPointNormals(source)[:, 2]
+        signedDistances = distances['SignedPointToPointDistance']
+        self.assertTrue(numpy.all(signedDistances[normalsZ > 1e-6] > 0))
+        self.assertTrue(numpy.all(signedDistances[normalsZ < -1e-6] < 0))
+        numpy.testing.assert_allclose(numpy.abs(signedDistances), distances['AbsolutePointToPointDistance'])
+
+        distances = self.core.computeDistances(source, target)
+        self.assertLessEqual(numpy.max(distances['AbsolutePointToPointDistance']), 1.0 + 1e-6)
+        self.assertEqual(self.core.computeDistances(source, target)['AbsolutePointToPointDistance'].tolist(),
+                         distances['AbsolutePointToPointDistance'].tolist())
+        self.assertEqual(len(self.core.locatorCache), 1)
+        # a new mesh for the same target replaces the cached tree
+        self.core.computeDistances(source, target, targetKey='Target')
+        sphere.SetRadius(11.0)
+        sphere.Update()
+        transformFilter.Update()
+        newTarget = vtk.vtkPolyData()
+        newTarget.DeepCopy(transformFilter.GetOutput())
+        self.core.computeDistances(source, newTarget, targetKey='Target')
+        self.assertEqual(len(self.core.locatorCache), 2)
+        self.assertEqual(self.core.locatorCache['Target'][0], newTarget.GetAddressAsString('vtkPolyData'))
+
+    @unittest.skipIf(vtk is None or scipy is None, 'VTK or SciPy is not available')
+    def testNeighbourhoodStatistics(self):
+        plane = vtk.vtkPlaneSource()
+        plane.SetOrigin(0.0, 0.0, 0.0)
+        plane.SetPoint1(10.0, 0.0, 0.0)
+        plane.SetPoint2(0.0, 10.0, 0.0)
+        plane.SetResolution(10, 10)
+        plane.Update()
+        polyData = plane.GetOutput()
+        points = self.core.getPointCoordinates(polyData)
+        interior = numpy.all((points[:, :2] > 2.5) & (points[:, :2] < 7.5), axis=1)
+
+        for numberOfRings, radius in [(2, 0.0), (1, 1.5)]:
+            (localMean, localSD, localPercentileRank), constantMaps = self.core.computeNeighbourhoodStatistics(
+                polyData, [points[:, 0], numpy.ones(len(points))], numberOfRings, radius)
+            numpy.testing.assert_allclose(localMean[interior], points[interior, 0], atol=1e-9)
+            numpy.testing.assert_allclose(localPercentileRank[interior], 50.0, atol=1e-9)
+            self.assertGreater(numpy.min(localSD[interior]), 0.0)
+            self.assertTrue(numpy.all(constantMaps[0] == 1.0))
+            self.assertTrue(numpy.all(constantMaps[1] == 0.0))
+            self.assertTrue(numpy.all(constantMaps[2] == 50.0))
+
+            #  Same maps when the neighbourhood matrix is built by blocks of a few points
+            core = MeshStatisticsCore()
+            core.maximumNeighbourhoodBlockSize = 50
+            blockMaps = core.computeNeighbourhoodStatistics(polyData, [points[:, 0]], numberOfRings, radius)[0]
+            for values, blockValues in zip((localMean, localSD, localPercentileRank), blockMaps):
+                numpy.testing.assert_allclose(blockValues, values, atol=1e-12)
+
+        #  Neighbourhoods too large are refused
+        self.core.maximumNeighbourhoodSize = 20
+        self.assertIsNone(self.core.computeNeighbourhoodStatistics(polyData, [points[:, 0]], 6, 0.0))
+        self.assertIsNone(self.core.computeNeighbourhoodStatistics(polyData, [points[:, 0]], 1, 5.0))
+
+if __name__ == '__main__':
+    unittest.main()